@@ -1,21 +1,24 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 import google.generativeai as genai
+import asyncio
 import os
 import uuid
 import shutil
-from typing import List, Optional, Dict
-from datetime import datetime, timedelta
+import time
+import heapq
+from typing import List, Optional, Dict, Tuple, Union
 import json
 from pathlib import Path
 
 # Import RAG components
 from rag.pdf_loader import pdf_to_text
-from rag.chunker import chunk_text
-from rag.embedder import embed_text, embed_chunks
-from rag.faiss_store import store_embeddings, save_chunks, load_index_and_chunks, search
+from rag.chunker import iter_chunk_batches
+from rag.embedder import CHUNK_BATCH_SIZE, embed_chunk_batches_async, warm_up
+from rag.faiss_store import store_embeddings, save_chunks, load_index_and_chunks, get_chunks, evict_cached
+from rag.batcher import Query, QueryBatcher
 
 # Load environment variables
 from dotenv import load_dotenv
@@ -27,7 +30,11 @@ if not GOOGLE_API_KEY:
     raise ValueError("GOOGLE_API_KEY not found in environment variables")
 genai.configure(api_key=GOOGLE_API_KEY)
 
-app = FastAPI()
+# Created once and shared across requests
+GEMINI_MODEL = genai.GenerativeModel('gemini-2.5-flash')
+
+# JSON responses are serialized with orjson
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Allow frontend access
 app.add_middleware(
@@ -42,9 +49,35 @@ app.add_middleware(
 TEMP_DIR = Path("temp")
 TEMP_DIR.mkdir(exist_ok=True)
 
+# Sessions unused for this long are deleted
+SESSION_TTL_SECONDS = 3600
+
+# Min-heap of (expiry time, session_id). Sessions are pushed once when
+# created; an entry whose session was used since is pushed again for its
+# new expiry when it is popped
+_EXPIRY_HEAP: List[Tuple[float, str]] = []
+
+# Wakes the expiry task when an earlier expiry is scheduled
+_EXPIRY_CHANGED = asyncio.Event()
+
+# Uploads up to this size are parsed from memory instead of from a saved file
+IN_MEMORY_UPLOAD_LIMIT = 50 * 1024 * 1024
+
+# Coalesces concurrent queries into batched embedding + search calls
+QUERY_BATCHER = QueryBatcher()
+
 # Store conversation history
 CONVERSATIONS: Dict[str, List[dict]] = {}
 
+# Chunk indices used for the last answer: session_id -> file_id -> indices
+LAST_RELEVANT: Dict[str, Dict[str, List[int]]] = {}
+
+# Requests asking to expand on the previous answer
+FOLLOW_UP_PHRASES = ["explain it", "tell me more", "elaborate", "explain this"]
+
+# Last access time per session (time.time() seconds)
+SESSION_ACCESS: Dict[str, float] = {}
+
 class Message(BaseModel):
     role: str
     content: str
@@ -55,20 +88,146 @@ class RAGQueryRequest(BaseModel):
     file_id: str
     history: Optional[List[Message]] = []
 
-def cleanup_old_files():
-    """Clean up files older than 1 hour"""
+def touch_session(session_id: str):
+    """Record a session access in memory and bump its directory mtime"""
+    SESSION_ACCESS[session_id] = time.time()
+    try:
+        os.utime(TEMP_DIR / session_id, None)
+    except OSError:
+        pass
+
+def session_last_access(entry: Union[os.DirEntry, Path]) -> float:
+    """Last access of a session, falling back to its directory mtime"""
+    last_access = SESSION_ACCESS.get(entry.name)
+    if last_access is None:
+        last_access = entry.stat().st_mtime
+    return last_access
+
+def forget_session(session_id: str):
+    """Drop all in-memory state held for a session"""
+    session_dir = TEMP_DIR / session_id
+    evict_cached(str(session_dir / "index.faiss"), str(session_dir / "chunks.arrow"))
+    CONVERSATIONS.pop(session_id, None)
+    LAST_RELEVANT.pop(session_id, None)
+    SESSION_ACCESS.pop(session_id, None)
+
+def schedule_expiry(session_id: str, last_access: float):
+    """Schedule a session to be checked for expiry one TTL after last_access"""
+    expiry = last_access + SESSION_TTL_SECONDS
+    if not _EXPIRY_HEAP or expiry < _EXPIRY_HEAP[0][0]:
+        _EXPIRY_CHANGED.set()
+    heapq.heappush(_EXPIRY_HEAP, (expiry, session_id))
+
+async def expire_session(session_id: str):
+    """Delete a session if it is still unused, otherwise reschedule it"""
+    try:
+        session_dir = TEMP_DIR / session_id
+        if not session_dir.is_dir():
+            # Already removed through the cleanup endpoint
+            forget_session(session_id)
+            return
+
+        last_access = session_last_access(session_dir)
+        if time.time() - last_access < SESSION_TTL_SECONDS:
+            schedule_expiry(session_id, last_access)
+            return
+
+        forget_session(session_id)
+        await asyncio.to_thread(shutil.rmtree, session_dir, ignore_errors=True)
+    except Exception as e:
+        print(f"Error expiring session {session_id}: {e}")
+
+async def expire_sessions():
+    """
+    Delete sessions as they expire. Sleeps until the earliest scheduled
+    expiry, or until a session is scheduled into an empty heap.
+    """
+    while True:
+        delay = _EXPIRY_HEAP[0][0] - time.time() if _EXPIRY_HEAP else None
+        if delay is None or delay > 0:
+            _EXPIRY_CHANGED.clear()
+            try:
+                await asyncio.wait_for(_EXPIRY_CHANGED.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        _, session_id = heapq.heappop(_EXPIRY_HEAP)
+        await expire_session(session_id)
+
+def schedule_existing_sessions():
+    """Schedule expiry for sessions left on disk by a previous run"""
     try:
-        current_time = datetime.now()
-        for item in TEMP_DIR.glob("*"):
-            if item.is_dir():
-                # Check if directory is older than 1 hour
-                if current_time - datetime.fromtimestamp(item.stat().st_mtime) > timedelta(hours=1):
-                    shutil.rmtree(item)
-                    # Clean up conversation history
-                    if str(item.name) in CONVERSATIONS:
-                        del CONVERSATIONS[str(item.name)]
+        with os.scandir(TEMP_DIR) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    schedule_expiry(entry.name, session_last_access(entry))
     except Exception as e:
-        print(f"Error cleaning up old files: {e}")
+        print(f"Error scanning old sessions: {e}")
+
+def _sendfile_all(src_fd: int, dst_fd: int, size: int):
+    """Copy size bytes between file descriptors inside the kernel"""
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+
+async def save_upload(file: UploadFile, file_path: Path):
+    """
+    Write an uploaded file to disk without blocking the event loop.
+
+    Only called for uploads above IN_MEMORY_UPLOAD_LIMIT, which Starlette
+    has already spooled to a real temp file (it rolls over past 1 MiB), so
+    on Linux the copy is a sendfile between the two descriptors.
+    """
+    try:
+        src_fd = file.file.fileno()
+        size = os.fstat(src_fd).st_size
+        with file_path.open("wb") as dst:
+            try:
+                await asyncio.to_thread(_sendfile_all, src_fd, dst.fileno(), size)
+            except (OSError, AttributeError):
+                # macOS only sends to sockets and Windows has no sendfile
+                file.file.seek(0)
+                dst.seek(0)
+                dst.truncate()
+                await asyncio.to_thread(shutil.copyfileobj, file.file, dst)
+    finally:
+        await file.close()
+
+async def receive_upload(file: UploadFile, file_path: Path) -> Union[bytes, str]:
+    """
+    Return an uploaded PDF as bytes, or spill it to file_path and return
+    that path when it is too large to keep in memory.
+    """
+    size = file.size
+    if size is None and getattr(file.file, "_rolled", False):
+        size = os.fstat(file.file.fileno()).st_size
+
+    if size is None or size <= IN_MEMORY_UPLOAD_LIMIT:
+        try:
+            return await file.read()
+        finally:
+            await file.close()
+
+    await save_upload(file, file_path)
+    return str(file_path)
+
+def get_follow_up_topic(original_query: str, conversation_history: List[dict]) -> Optional[str]:
+    """
+    Return the previous answer a generic "explain" request refers to, if any.
+    """
+    lower_query = original_query.lower()
+    if not any(phrase in lower_query for phrase in FOLLOW_UP_PHRASES):
+        return None
+
+    # Look for the most recent topic in conversation
+    for msg in reversed(conversation_history[:-1]):  # Exclude current message
+        if msg['role'] == 'assistant' and len(msg['content']) > 50:  # Substantial response
+            return msg['content']
+    return None
 
 def get_enhanced_query(original_query: str, conversation_history: List[dict]) -> str:
     """
@@ -85,12 +244,9 @@ def get_enhanced_query(original_query: str, conversation_history: List[dict]) ->
     ])
     
     # Handle generic "explain" requests more intelligently
-    lower_query = original_query.lower()
-    if any(phrase in lower_query for phrase in ["explain it", "tell me more", "elaborate", "explain this"]):
-        # Look for the most recent topic in conversation
-        for msg in reversed(conversation_history[:-1]):  # Exclude current message
-            if msg['role'] == 'assistant' and len(msg['content']) > 50:  # Substantial response
-                return f"Explain in detail the following topic from the document: {msg['content'][:200]}..."
+    topic = get_follow_up_topic(original_query, conversation_history)
+    if topic is not None:
+        return f"Explain in detail the following topic from the document: {topic[:200]}..."
     
     enhanced_query = f"""
     Recent conversation context:
@@ -120,40 +276,39 @@ async def upload_file(file: UploadFile = File(...)):
         
         # Initialize conversation history
         CONVERSATIONS[session_id] = []
+        SESSION_ACCESS[session_id] = time.time()
+        schedule_expiry(session_id, SESSION_ACCESS[session_id])
         
-        # Save uploaded file
+        # Receive uploaded file; only large files are written to disk
         file_id = str(uuid.uuid4())
         file_path = session_dir / f"{file_id}.pdf"
         
-        try:
-            with file_path.open("wb") as f:
-                shutil.copyfileobj(file.file, f)
-        finally:
-            file.file.close()
+        pdf_source = await receive_upload(file, file_path)
 
-        # Extract text from PDF
-        text = pdf_to_text(str(file_path))
+        # Extract text from PDF; the PDF itself isn't needed afterwards
+        text = await asyncio.to_thread(pdf_to_text, pdf_source)
+        file_path.unlink(missing_ok=True)
         if not text:
             raise ValueError("Failed to extract text from PDF")
 
-        # Create chunks
-        chunks = chunk_text(text)
+        # Create chunks and generate embeddings, chunking the next batch
+        # while the model embeds the current one
+        chunks, embeddings = await embed_chunk_batches_async(
+            iter_chunk_batches(text, batch_size=CHUNK_BATCH_SIZE)
+        )
         if not chunks:
             raise ValueError("Failed to create text chunks")
-
-        # Generate embeddings
-        embeddings = embed_chunks(chunks)
         if embeddings is None:
             raise ValueError("Failed to generate embeddings")
 
         # Save embeddings and chunks
         index_path = session_dir / "index.faiss"
-        chunks_path = session_dir / "chunks.json"
+        chunks_path = session_dir / "chunks.arrow"
         
-        if not store_embeddings(embeddings, str(index_path)):
+        if not await asyncio.to_thread(store_embeddings, embeddings, str(index_path)):
             raise ValueError("Failed to store embeddings")
         
-        if not save_chunks(chunks, str(chunks_path)):
+        if not await asyncio.to_thread(save_chunks, chunks, str(chunks_path)):
             raise ValueError("Failed to save chunks")
 
         return {
@@ -167,8 +322,8 @@ async def upload_file(file: UploadFile = File(...)):
         # Clean up on error
         if 'session_dir' in locals() and session_dir.exists():
             shutil.rmtree(session_dir)
-        if 'session_id' in locals() and session_id in CONVERSATIONS:
-            del CONVERSATIONS[session_id]
+        if 'session_id' in locals():
+            forget_session(session_id)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/rag/query")
@@ -183,6 +338,7 @@ async def query_document(request: RAGQueryRequest):
         session_dir = TEMP_DIR / request.session_id
         if not session_dir.exists():
             return StreamingResponse(error_stream("Session not found"))
+        touch_session(request.session_id)
 
         # Initialize conversation history if not exists
         if request.session_id not in CONVERSATIONS:
@@ -199,29 +355,33 @@ async def query_document(request: RAGQueryRequest):
 
         # Load index and chunks
         index_path = session_dir / "index.faiss"
-        chunks_path = session_dir / "chunks.json"
+        chunks_path = session_dir / "chunks.arrow"
         
         if not index_path.exists() or not chunks_path.exists():
             return StreamingResponse(error_stream("Session data not found"))
 
         # Load index and chunks
-        index, chunks = load_index_and_chunks(str(index_path), str(chunks_path))
+        index, chunks = await asyncio.to_thread(load_index_and_chunks, str(index_path), str(chunks_path))
         if index is None or chunks is None:
             return StreamingResponse(error_stream("Failed to load session data"))
 
-        # Generate embedding for enhanced query
-        enhanced_query = get_enhanced_query(request.message, conversation)
-        query_embedding = embed_text(enhanced_query)
-        if query_embedding is None:
-            return StreamingResponse(error_stream("Failed to process query"))
-
-        # Search for relevant chunks
-        relevant_indices = search(index, query_embedding, k=5)  # Increased k for more context
-        if not relevant_indices:
-            return StreamingResponse(error_stream("No relevant content found"))
+        # Follow-ups on the previous answer reuse the chunks that fed it
+        last_relevant = LAST_RELEVANT.setdefault(request.session_id, {})
+        relevant_indices = last_relevant.get(request.file_id)
+        if relevant_indices is None or get_follow_up_topic(request.message, conversation) is None:
+            # Embed the enhanced query and search for relevant chunks
+            enhanced_query = get_enhanced_query(request.message, conversation)
+            relevant_indices = await QUERY_BATCHER.submit(
+                Query(enhanced_query, index, k=5, cache_key=str(index_path))  # Increased k for more context
+            )
+            if relevant_indices is None:
+                return StreamingResponse(error_stream("Failed to process query"))
+            if not relevant_indices:
+                return StreamingResponse(error_stream("No relevant content found"))
+            last_relevant[request.file_id] = relevant_indices
 
         # Get relevant chunks
-        context = "\n\n".join([chunks[i] for i in relevant_indices])
+        context = "\n\n".join(get_chunks(chunks, relevant_indices))
 
         # Add user message to conversation
         conversation.append({"role": "user", "content": request.message})
@@ -252,18 +412,18 @@ async def query_document(request: RAGQueryRequest):
         Please provide a detailed and accurate response:"""
 
         # Generate response with Gemini
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content(prompt, stream=True)
+        # The async client awaits each streamed chunk instead of blocking the loop
+        response = await GEMINI_MODEL.generate_content_async(prompt, stream=True)
 
         async def generate():
-            full_response = ""
+            response_parts = []
             try:
-                for chunk in response:
+                async for chunk in response:
                     if chunk.text:
-                        full_response += chunk.text
+                        response_parts.append(chunk.text)
                         yield chunk.text
                 # Add assistant response to conversation history
-                conversation.append({"role": "assistant", "content": full_response})
+                conversation.append({"role": "assistant", "content": "".join(response_parts)})
             except Exception as e:
                 error_msg = f"\nError during response generation: {str(e)}"
                 yield error_msg
@@ -281,15 +441,19 @@ async def cleanup_session(session_id: str):
     """
     try:
         session_dir = TEMP_DIR / session_id
+        forget_session(session_id)
         if session_dir.exists():
             shutil.rmtree(session_dir)
-        if session_id in CONVERSATIONS:
-            del CONVERSATIONS[session_id]
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Clean up old files on startup
+# Start session expiry and load the embedding model on startup
 @app.on_event("startup")
 async def startup_event():
-    cleanup_old_files() 
\ No newline at end of file
+    # Not awaited: the server accepts requests while the model loads, and
+    # encodes queue behind the load on the encoder thread
+    app.state.warm_up = asyncio.create_task(warm_up())
+    # Sessions from a previous run that already expired are removed right away
+    schedule_existing_sessions()
+    app.state.expire_sessions = asyncio.create_task(expire_sessions()) 
\ No newline at end of file
@@ -0,0 +1,157 @@
+import asyncio
+import faiss
+import numpy as np
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor
+from typing import Any, List, NamedTuple, Optional
+
+from rag.embedder import ENCODE_POOL, embed_queries
+from rag.faiss_store import search_batch
+
+class MicroBatcher(ABC):
+    """
+    Coalesce calls that arrive within a short window into one batch.
+
+    Subclasses implement process(), which receives the queued items in
+    arrival order and returns one result per item. It runs in the given
+    executor so the event loop stays free while a batch is processed.
+    """
+
+    def __init__(self, max_batch: int, window: float, executor: Optional[Executor] = None):
+        self.max_batch = max_batch
+        self.window = window
+        self.executor = executor
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Queue an item and wait for its result.
+
+        Args:
+            item (Any): Work item passed to process()
+
+        Returns:
+            Any: The result process() produced for this item
+        """
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+
+            # Give concurrent callers a moment to join the batch
+            if self._queue.empty():
+                await asyncio.sleep(self.window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.process, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+
+    @abstractmethod
+    def process(self, items: List[Any]) -> List[Any]:
+        """Process a batch, returning one result per item in order."""
+
+class Query(NamedTuple):
+    text: str
+    index: faiss.Index
+    k: int
+    cache_key: Optional[str] = None
+
+class Search(NamedTuple):
+    vector: np.ndarray
+    index: faiss.Index
+    k: int
+    cache_key: Optional[str] = None
+
+class EmbedBatcher(MicroBatcher):
+    """
+    Embed concurrent query texts in one model call. Each text resolves to
+    its embedding row, or None if embedding failed.
+    """
+
+    def __init__(self, max_batch: int = 16, window: float = 0.005):
+        # Runs on the encoder thread, which owns the model
+        super().__init__(max_batch, window, ENCODE_POOL)
+
+    def process(self, items: List[str]) -> List[Optional[np.ndarray]]:
+        embeddings = embed_queries(items)
+        if embeddings is None:
+            return [None] * len(items)
+        return list(embeddings)
+
+class SearchBatcher(MicroBatcher):
+    """
+    Stack concurrent searches into one (B, d) FAISS call per distinct
+    index. Each search resolves to its top-k chunk indices, or None if
+    the search failed.
+    """
+
+    def __init__(self, max_batch: int = 64, window: float = 0.001):
+        # FAISS releases the GIL, so searches run on the default thread pool
+        super().__init__(max_batch, window)
+
+    def process(self, items: List[Search]) -> List[Optional[List[int]]]:
+        results: List[Optional[List[int]]] = [None] * len(items)
+
+        # Group searches by the index they target
+        groups = {}
+        for position, search in enumerate(items):
+            groups.setdefault((id(search.index), search.cache_key), []).append(position)
+
+        for positions in groups.values():
+            first = items[positions[0]]
+            k = max(items[position].k for position in positions)
+            vectors = np.stack([items[position].vector for position in positions])
+            found = search_batch(first.index, vectors, k, first.cache_key)
+            if found is None:
+                continue
+            for position, indices in zip(positions, found):
+                results[position] = indices[:items[position].k]
+
+        return results
+
+class QueryBatcher:
+    """
+    Answer queries in two batched stages: texts are embedded together on
+    the encoder thread, then the vectors are searched together, so queries
+    served from the embedding cache still share a FAISS call. Each query
+    resolves to its top-k chunk indices, or None if embedding or search
+    failed.
+    """
+
+    def __init__(self):
+        self.embedder = EmbedBatcher()
+        self.searcher = SearchBatcher()
+
+    async def submit(self, query: Query) -> Optional[List[int]]:
+        """
+        Embed and search one query alongside any concurrent ones.
+
+        Args:
+            query (Query): Query text and the index to search
+
+        Returns:
+            Optional[List[int]]: Indices of the most similar chunks or None on failure
+        """
+        vector = await self.embedder.submit(query.text)
+        if vector is None:
+            return None
+        return await self.searcher.submit(Search(vector, query.index, query.k, query.cache_key))
@@ -1,5 +1,141 @@
+import numpy as np
+import os
 import tiktoken
-from typing import List
+from typing import Iterator, List, Tuple
+
+# Load the BPE vocabulary once and share it across calls
+_ENC = tiktoken.get_encoding("cl100k_base")  # Using OpenAI's encoding
+
+def _token_byte_lengths() -> np.ndarray:
+    """
+    UTF-8 byte length of every token in the vocabulary; 0 for unused ids.
+    """
+    lengths = np.zeros(_ENC.n_vocab, dtype=np.uint8)
+    for token in range(_ENC.n_vocab):
+        try:
+            lengths[token] = len(_ENC.decode_single_token_bytes(token))
+        except KeyError:
+            pass
+    return lengths
+
+# Built once so token offsets are a single gather instead of a decode
+TOKEN_BYTE_LEN = _token_byte_lengths()
+
+def _last_before(positions: np.ndarray, low: int, high: int) -> int:
+    """
+    Return the largest position in the sorted array within [low, high], or -1.
+    """
+    i = int(np.searchsorted(positions, high, side="right")) - 1
+    if i >= 0 and positions[i] >= low:
+        return int(positions[i])
+    return -1
+
+def _chunk_bounds(text: str, tokens: List[int], chunk_size: int, overlap: int) -> List[Tuple[int, int]]:
+    """
+    Compute the (start, end) token range of every chunk of text.
+    """
+    # The text's UTF-8 bytes, and the byte offset where each token starts;
+    # offsets[i + 1] is where token i ends. tiktoken replaces lone
+    # surrogates with U+FFFD, which is as long as their surrogatepass bytes
+    data = np.frombuffer(text.encode("utf-8", "surrogatepass"), dtype=np.uint8)
+    offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+    np.cumsum(TOKEN_BYTE_LEN[np.asarray(tokens, dtype=np.int32)], dtype=np.int64, out=offsets[1:])
+
+    # Positions of every break candidate, found in one pass over the bytes.
+    # Separators are ASCII, so matching bytes is exact
+    periods = np.flatnonzero((data[:-1] == ord(".")) & (data[1:] == ord(" ")))
+    newlines = np.flatnonzero(data == ord("\n"))
+    bounds = []
+    start = 0
+    
+    while start < len(tokens):
+        # Get the chunk's end position
+        end = start + chunk_size
+        
+        # If this is not the last chunk, try to find a good break point
+        if end < len(tokens):
+            # Look for a period or newline in the overlap region
+            overlap_start = max(start, end - overlap)
+            region_start, region_end = offsets[overlap_start], offsets[end]
+            
+            # Try to find a good break point: the last separator that fits
+            # entirely inside the region
+            break_point = _last_before(periods, region_start, region_end - 2)
+            if break_point == -1:
+                break_point = _last_before(newlines, region_start, region_end - 1)
+            
+            if break_point != -1:
+                # Adjust end to the token boundary just past the period or newline
+                end = int(np.searchsorted(offsets, break_point + 1, side="left"))
+        
+        bounds.append((start, end))
+        
+        # Move the start pointer, accounting for overlap
+        start = max(start + chunk_size - overlap, end - overlap)
+
+    return bounds
+
+def iter_chunks(text: str, chunk_size: int = 500, overlap: int = 50) -> Iterator[str]:
+    """
+    Split text into overlapping chunks using tiktoken for token counting.
+    
+    Args:
+        text (str): Text to split into chunks
+        chunk_size (int): Maximum number of tokens per chunk
+        overlap (int): Number of tokens to overlap between chunks
+        
+    Yields:
+        str: The next text chunk
+    """
+    # Encode the text into tokens
+    tokens = _ENC.encode(text)
+    bounds = _chunk_bounds(text, tokens, chunk_size, overlap)
+    yield from _decode_chunks(tokens, bounds)
+
+def _decode_chunks(tokens: List[int], bounds: List[Tuple[int, int]]) -> List[str]:
+    """
+    Decode the given token ranges, dropping chunks that are only whitespace.
+    """
+    # Decode all chunks in one call; tiktoken spreads it over threads
+    decoded = _ENC.decode_batch(
+        [tokens[start:end] for start, end in bounds],
+        num_threads=os.cpu_count() or 1,
+    )
+    return [chunk for chunk in map(str.strip, decoded) if chunk]
+
+def iter_chunk_batches(text: str, batch_size: int = 1024, chunk_size: int = 500, overlap: int = 50) -> Iterator[List[str]]:
+    """
+    Split text into overlapping chunks like chunk_text, decoding and
+    yielding them a batch at a time so a consumer can start on the first
+    batch while the rest are decoded.
+    
+    Args:
+        text (str): Text to split into chunks
+        batch_size (int): Maximum number of chunks per batch
+        chunk_size (int): Maximum number of tokens per chunk
+        overlap (int): Number of tokens to overlap between chunks
+        
+    Yields:
+        List[str]: The next batch of text chunks
+    """
+    if not text:
+        return
+
+    try:
+        tokens = _ENC.encode(text)
+        bounds = _chunk_bounds(text, tokens, chunk_size, overlap)
+    except Exception as e:
+        print(f"Error chunking text: {e}")
+        # Fallback to simple character-based chunking
+        chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size-overlap)]
+        for i in range(0, len(chunks), batch_size):
+            yield chunks[i:i + batch_size]
+        return
+
+    for i in range(0, len(bounds), batch_size):
+        batch = _decode_chunks(tokens, bounds[i:i + batch_size])
+        if batch:
+            yield batch
 
 def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
     """
@@ -17,42 +153,7 @@ def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]
         return []
 
     try:
-        # Get the encoding
-        enc = tiktoken.get_encoding("cl100k_base")  # Using OpenAI's encoding
-        
-        # Encode the text into tokens
-        tokens = enc.encode(text)
-        chunks = []
-        start = 0
-        
-        while start < len(tokens):
-            # Get the chunk's end position
-            end = start + chunk_size
-            
-            # If this is not the last chunk, try to find a good break point
-            if end < len(tokens):
-                # Look for a period or newline in the overlap region
-                overlap_start = max(start, end - overlap)
-                decoded_overlap = enc.decode(tokens[overlap_start:end])
-                
-                # Try to find a good break point
-                break_point = decoded_overlap.rfind(". ")
-                if break_point == -1:
-                    break_point = decoded_overlap.rfind("\n")
-                
-                if break_point != -1:
-                    # Adjust end to the break point
-                    end = overlap_start + break_point + 2  # +2 to include the period and space
-            
-            # Decode the chunk and add it to the list
-            chunk = enc.decode(tokens[start:end]).strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            # Move the start pointer, accounting for overlap
-            start = max(start + chunk_size - overlap, end - overlap)
-        
-        return chunks
+        return list(iter_chunks(text, chunk_size, overlap))
     except Exception as e:
         print(f"Error chunking text: {e}")
         # Fallback to simple character-based chunking
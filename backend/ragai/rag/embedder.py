@@ -1,9 +1,163 @@
-from sentence_transformers import SentenceTransformer
 import numpy as np
-from typing import List, Optional
+import asyncio
+import os
+import queue
+import threading
+import xxhash
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple, Union
 
-# Initialize the model once at module level
-model = SentenceTransformer('all-MiniLM-L6-v2')
+MODEL_NAME = 'all-MiniLM-L6-v2'
+HF_MODEL_ID = f'sentence-transformers/{MODEL_NAME}'
+
+# "auto" (default) runs PyTorch in half precision on CUDA and an int8-quantized
+# ONNX Runtime graph on CPU; "torch" or "onnx" force a backend
+EMBEDDER_BACKEND = os.getenv("EMBEDDER_BACKEND", "auto")
+ONNX_MODEL_DIR = Path(os.getenv("ONNX_MODEL_DIR", f"models/{MODEL_NAME}-onnx-int8"))
+
+class OnnxEncoder:
+    """
+    ONNX Runtime version of the sentence-transformers model with int8
+    dynamic quantization. Implements the part of SentenceTransformer.encode
+    used by this module: mean pooling followed by L2 normalization, as in
+    the all-MiniLM-L6-v2 pipeline.
+    """
+
+    QUANTIZED_FILE = "model_quantized.onnx"
+    max_seq_length = 256
+
+    def __init__(self, model_dir: Path):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+
+        if not (model_dir / self.QUANTIZED_FILE).exists():
+            # Export and quantize once; later startups load the saved graph
+            exported = ORTModelForFeatureExtraction.from_pretrained(HF_MODEL_ID, export=True)
+            quantizer = ORTQuantizer.from_pretrained(exported)
+            config = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            quantizer.quantize(save_dir=model_dir, quantization_config=config)
+            AutoTokenizer.from_pretrained(HF_MODEL_ID).save_pretrained(model_dir)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(model_dir, file_name=self.QUANTIZED_FILE)
+        self.dimension = self.model.config.hidden_size
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        # Longest first, so each batch pads to similar lengths
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        embeddings = np.empty((len(sentences), self.dimension), dtype='float32')
+        for start in range(0, len(sentences), batch_size):
+            batch_ids = order[start:start + batch_size]
+            inputs = self.tokenizer(
+                [sentences[i] for i in batch_ids],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"][..., None].astype('float32')
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            embeddings[batch_ids] = pooled
+
+        return embeddings[0] if single else embeddings
+
+def _load_model():
+    """Load the embedding model for the configured backend."""
+    # Imported here so importing this module doesn't pull in PyTorch
+    import torch
+
+    use_cuda = torch.cuda.is_available()
+    backend = EMBEDDER_BACKEND
+    if backend == "auto":
+        backend = "torch" if use_cuda else "onnx"
+
+    if backend == "onnx":
+        try:
+            return OnnxEncoder(ONNX_MODEL_DIR)
+        except Exception as e:
+            print(f"Error loading ONNX embedder, falling back to PyTorch: {e}")
+
+    from sentence_transformers import SentenceTransformer
+    if not use_cuda:
+        # Intra-op parallelism across every core for the CPU forward pass
+        torch.set_num_threads(os.cpu_count() or 1)
+    model = SentenceTransformer(MODEL_NAME, device="cuda" if use_cuda else "cpu")
+    model.eval()
+    if use_cuda:
+        # Half the memory traffic; outputs are cast to float32 for FAISS
+        model.half()
+        # Fuse the transformer's kernels; sequence lengths vary per batch
+        model[0].auto_model = torch.compile(model[0].auto_model, mode="reduce-overhead", dynamic=True)
+    return model
+
+# The model is loaded once, on first use
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    """
+    Return the embedding model, loading it on first call.
+    
+    Returns:
+        The loaded SentenceTransformer or OnnxEncoder
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = _load_model()
+    return _model
+
+def _encode(sentences: Union[str, List[str]], **kwargs) -> np.ndarray:
+    """Run the model's encode, with autograd tracking off for PyTorch models."""
+    model = get_model()
+    if isinstance(model, OnnxEncoder):
+        return model.encode(sentences, **kwargs)
+
+    import torch
+    with torch.inference_mode():
+        return model.encode(sentences, **kwargs)
+
+# Chunks per forward pass when embedding a document. Chunks are ~500 cl100k
+# tokens, so nearly all of them are truncated to the model's 256-token limit
+# and batches are full length whatever their size. Batch size therefore sets
+# activation memory (attention alone is batch x 12 heads x 256 x 256 floats
+# per layer, ~3 GB at 1024) rather than padding: large batches keep a GPU
+# busy, while on CPU they only cost memory
+CUDA_EMBED_BATCH_SIZE = 1024
+CPU_EMBED_BATCH_SIZE = 32
+
+# Chunks handed from the chunker to the model per pipeline step
+CHUNK_BATCH_SIZE = 1024
+
+def _embed_batch_size() -> int:
+    """Forward-pass batch size for the loaded model's device."""
+    model = get_model()
+    on_cuda = not isinstance(model, OnnxEncoder) and model.device.type == "cuda"
+    return CUDA_EMBED_BATCH_SIZE if on_cuda else CPU_EMBED_BATCH_SIZE
+
+# Query embeddings memoized by normalized query text
+QUERY_CACHE_SIZE = 512
+_QUERY_CACHE: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+# Chunk embeddings memoized by a hash of the chunk text, so re-uploading a
+# document (or one sharing passages) skips the model for known chunks
+CHUNK_CACHE_SIZE = 16_384
+_CHUNK_CACHE: "OrderedDict[int, np.ndarray]" = OrderedDict()
+
+# Single worker dedicated to the model so encodes run off the event loop;
+# PyTorch and ONNX Runtime release the GIL inside their kernels. All model
+# calls, and both caches, are only touched from this thread
+ENCODE_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedder")
 
 def embed_text(text: str) -> Optional[np.ndarray]:
     """
@@ -17,15 +171,58 @@ def embed_text(text: str) -> Optional[np.ndarray]:
     """
     try:
         # Generate embedding and ensure it's float32
-        embedding = model.encode(text, convert_to_numpy=True)
+        embedding = _encode(text, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
         return embedding.astype('float32')
     except Exception as e:
         print(f"Error generating embedding: {e}")
         return None
 
+def _query_key(text: str) -> str:
+    # The model's tokenizer is uncased and ignores surrounding whitespace,
+    # so normalizing the key doesn't change the embedding
+    return text.strip().lower()
+
+def embed_queries(texts: List[str]) -> Optional[np.ndarray]:
+    """
+    Generate embeddings for several search queries in one model call,
+    reusing cached vectors for queries seen before.
+    
+    Args:
+        texts (List[str]): Query texts
+        
+    Returns:
+        Optional[np.ndarray]: One embedding row per query or None if generation fails
+    """
+    keys = [_query_key(text) for text in texts]
+    found = {key: _QUERY_CACHE[key] for key in keys if key in _QUERY_CACHE}
+    missing = [key for key in dict.fromkeys(keys) if key not in found]
+
+    if missing:
+        try:
+            encoded = _encode(
+                missing,
+                batch_size=len(missing),
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            ).astype('float32')
+        except Exception as e:
+            print(f"Error generating query embeddings: {e}")
+            return None
+        found.update(zip(missing, encoded))
+
+    for key in keys:
+        _QUERY_CACHE[key] = found[key]
+        _QUERY_CACHE.move_to_end(key)
+    while len(_QUERY_CACHE) > QUERY_CACHE_SIZE:
+        _QUERY_CACHE.popitem(last=False)
+
+    return np.stack([found[key] for key in keys])
+
 def embed_chunks(chunks: List[str]) -> Optional[np.ndarray]:
     """
-    Generate embeddings for multiple text chunks efficiently.
+    Generate embeddings for multiple text chunks efficiently, reusing
+    cached vectors for chunks embedded before.
     
     Args:
         chunks (List[str]): List of text chunks to embed
@@ -36,9 +233,33 @@ def embed_chunks(chunks: List[str]) -> Optional[np.ndarray]:
     try:
         if not chunks:
             return None
-        # Batch encode all chunks at once - much more efficient
-        embeddings = model.encode(chunks, convert_to_numpy=True)
-        return embeddings.astype('float32')
+        keys = [xxhash.xxh64_intdigest(chunk.encode()) for chunk in chunks]
+        found = {key: _CHUNK_CACHE[key] for key in keys if key in _CHUNK_CACHE}
+        missing = {}
+        for key, chunk in zip(keys, chunks):
+            if key not in found:
+                missing.setdefault(key, chunk)
+
+        if missing:
+            # One call with every new chunk, split into forward passes sized
+            # for the device. Vectors are L2-normalized so the index can
+            # compare them by inner product
+            encoded = _encode(
+                list(missing.values()),
+                batch_size=_embed_batch_size(),
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            ).astype('float32', copy=False)
+            found.update(zip(missing, encoded))
+
+        for key in keys:
+            _CHUNK_CACHE[key] = found[key]
+            _CHUNK_CACHE.move_to_end(key)
+        while len(_CHUNK_CACHE) > CHUNK_CACHE_SIZE:
+            _CHUNK_CACHE.popitem(last=False)
+
+        return np.stack([found[key] for key in keys])
     except Exception as e:
         print(f"Error generating embeddings: {e}")
         # Fallback to individual processing
@@ -47,4 +268,77 @@ def embed_chunks(chunks: List[str]) -> Optional[np.ndarray]:
             embedding = embed_text(chunk)
             if embedding is not None:
                 results.append(embedding)
-        return np.array(results).astype('float32') if results else None 
\ No newline at end of file
+        return np.array(results).astype('float32') if results else None 
+
+# Chunk batches that may wait between the chunker and the model
+PIPELINE_DEPTH = 2
+
+def embed_chunk_batches(batches: Iterable[List[str]]) -> Tuple[List[str], Optional[np.ndarray]]:
+    """
+    Embed batches of chunks as they are produced. The batches are pulled
+    on a separate thread, so the next one is chunked while the model
+    embeds the current one.
+    
+    Args:
+        batches (Iterable[List[str]]): Chunk batches, e.g. from iter_chunk_batches
+        
+    Returns:
+        Tuple[List[str], Optional[np.ndarray]]: All chunks in order, and one
+            embedding row per chunk or None if generation fails
+    """
+    handoff: "queue.Queue" = queue.Queue(maxsize=PIPELINE_DEPTH)
+
+    def produce():
+        try:
+            for batch in batches:
+                handoff.put(batch)
+        except Exception as e:
+            handoff.put(e)
+        else:
+            handoff.put(None)
+
+    threading.Thread(target=produce, name="chunker", daemon=True).start()
+
+    chunks: List[str] = []
+    embedded: List[np.ndarray] = []
+    failed = False
+    while True:
+        batch = handoff.get()
+        if batch is None:
+            break
+        if isinstance(batch, Exception):
+            print(f"Error chunking text: {batch}")
+            failed = True
+            break
+        chunks.extend(batch)
+        # Keep draining after a failure so the producer never blocks
+        if failed:
+            continue
+        embeddings = embed_chunks(batch)
+        if embeddings is None or len(embeddings) != len(batch):
+            failed = True
+            continue
+        embedded.append(embeddings)
+
+    if failed or not embedded:
+        return chunks, None
+    return chunks, np.concatenate(embedded)
+
+async def embed_chunk_batches_async(batches: Iterable[List[str]]) -> Tuple[List[str], Optional[np.ndarray]]:
+    """
+    Run embed_chunk_batches on the encoder thread without blocking the event loop.
+    
+    Args:
+        batches (Iterable[List[str]]): Chunk batches, e.g. from iter_chunk_batches
+        
+    Returns:
+        Tuple[List[str], Optional[np.ndarray]]: All chunks in order, and one
+            embedding row per chunk or None if generation fails
+    """
+    return await asyncio.get_running_loop().run_in_executor(ENCODE_POOL, embed_chunk_batches, batches)
+
+async def warm_up() -> None:
+    """
+    Load the model on the encoder thread, ahead of the first request.
+    """
+    await asyncio.get_running_loop().run_in_executor(ENCODE_POOL, get_model)
\ No newline at end of file
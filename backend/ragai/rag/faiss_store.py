@@ -1,26 +1,101 @@
 import faiss
 import numpy as np
-import json
-from typing import List, Tuple, Optional
+import pyarrow as pa
+import math
+import os
+import threading
+from numba import njit
+from collections import OrderedDict
+from typing import List, Optional, Set, Tuple
+
+# Index selection thresholds (number of vectors)
+FLAT_MAX_VECTORS = 1_000
+HNSW_MAX_VECTORS = 50_000
+
+# HNSW graph degree and build/search beam widths
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# Number of IVF lists probed per query
+IVF_NPROBE = 8
+
+# Opt-in GPU offload; needs a faiss build with GPU support and a visible device
+USE_GPU = (
+    os.getenv("FAISS_USE_GPU") == "1"
+    and hasattr(faiss, "index_cpu_to_all_gpus")
+    and faiss.get_num_gpus() > 0
+)
+
+# Guards the caches below, which are shared by worker threads
+_CACHE_LOCK = threading.Lock()
+
+# Loaded indices kept in-process, keyed by path: index_path -> (mtime, index)
+INDEX_CACHE_SIZE = 64
+_INDEX_CACHE: "OrderedDict[str, Tuple[float, faiss.Index]]" = OrderedDict()
+
+# Chunks are immutable after upload; keep memory-mapped columns keyed by path
+CHUNK_CACHE_SIZE = 128
+_CHUNK_CACHE: "OrderedDict[str, pa.Array]" = OrderedDict()
+
+# Top-k results for repeated queries: (index_path, query bytes, k) -> indices
+SEARCH_CACHE_SIZE = 1024
+_SEARCH_CACHE: "OrderedDict[Tuple[str, bytes, int], List[int]]" = OrderedDict()
+
+def _build_index(matrix: np.ndarray) -> faiss.Index:
+    """
+    Pick an index type based on corpus size. All indices use inner product
+    on L2-normalized vectors, i.e. cosine similarity.
+    """
+    n, dimension = matrix.shape
+    if n < FLAT_MAX_VECTORS:
+        # Exhaustive scan over 8-bit codes: a quarter of the float32 bytes
+        return faiss.IndexScalarQuantizer(
+            dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
+    if n < HNSW_MAX_VECTORS:
+        # Graph over 8-bit codes; the quantizer is trained before the add
+        index = faiss.IndexHNSWSQ(
+            dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+
+    nlist = int(4 * math.sqrt(n))
+    m = min(dimension // 4, 64)
+    return faiss.index_factory(dimension, f"IVF{nlist},PQ{m}x8", faiss.METRIC_INNER_PRODUCT)
 
 def store_embeddings(embeddings: np.ndarray, index_path: str) -> bool:
     """
     Store embeddings in a FAISS index.
     
     Args:
-        embeddings (np.ndarray): Array of embedding vectors
+        embeddings (np.ndarray): Array of L2-normalized embedding vectors,
+            as returned by embed_chunks
         index_path (str): Path to save the FAISS index
         
     Returns:
         bool: True if successful, False otherwise
     """
     try:
-        # Create index with the correct dimension
-        dimension = embeddings.shape[1]
-        index = faiss.IndexFlatL2(dimension)
-        
-        # Add embeddings to index
-        index.add(embeddings.astype('float32'))
+        # Vectors arrive normalized, so inner product equals cosine similarity
+        matrix = np.ascontiguousarray(embeddings, dtype='float32')
+
+        # Create index sized for the corpus; quantized indices need training
+        index = _build_index(matrix)
+        gpu_index = _to_gpu(index) if USE_GPU else None
+        if gpu_index is not None:
+            # Train and add on the device, then bring the index back to write it
+            if not gpu_index.is_trained:
+                gpu_index.train(matrix)
+            gpu_index.add(matrix)
+            index = faiss.index_gpu_to_cpu(gpu_index)
+        else:
+            if not index.is_trained:
+                index.train(matrix)
+
+            # Add embeddings to index
+            index.add(matrix)
         
         # Save index to file
         faiss.write_index(index, index_path)
@@ -31,7 +106,7 @@ def store_embeddings(embeddings: np.ndarray, index_path: str) -> bool:
 
 def save_chunks(chunks: List[str], chunks_path: str) -> bool:
     """
-    Save text chunks to a JSON file.
+    Save text chunks to an Arrow IPC file as a single string column.
     
     Args:
         chunks (List[str]): List of text chunks
@@ -41,14 +116,118 @@ def save_chunks(chunks: List[str], chunks_path: str) -> bool:
         bool: True if successful, False otherwise
     """
     try:
-        with open(chunks_path, 'w') as f:
-            json.dump(chunks, f)
+        batch = pa.record_batch([pa.array(chunks, type=pa.large_string())], names=["text"])
+        with pa.OSFile(chunks_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, batch.schema) as writer:
+                writer.write_batch(batch)
         return True
     except Exception as e:
         print(f"Error saving chunks: {e}")
         return False
 
-def load_index_and_chunks(index_path: str, chunks_path: str) -> Tuple[Optional[faiss.Index], Optional[List[str]]]:
+# Index types already reported as falling back to CPU
+_GPU_FALLBACK_LOGGED: Set[str] = set()
+
+def _to_gpu(index: faiss.Index) -> Optional[faiss.Index]:
+    """
+    Copy an index onto all visible GPUs, or return None for index types
+    faiss can't run there (HNSW, plain scalar quantizer).
+    """
+    # The IVF-PQ tier's 64 sub-quantizers need half-precision lookup tables
+    # to fit in a block's shared memory; float32 ones make the clone fail
+    options = faiss.GpuMultipleClonerOptions()
+    options.useFloat16 = True
+    try:
+        gpu_index = faiss.index_cpu_to_all_gpus(index, co=options)
+    except RuntimeError as e:
+        kind = type(index).__name__
+        if kind not in _GPU_FALLBACK_LOGGED:
+            _GPU_FALLBACK_LOGGED.add(kind)
+            print(f"{kind} can't run on GPU, keeping it on CPU: {e}")
+        return None
+    if faiss.try_extract_index_ivf(index) is not None:
+        # GPU indices don't expose the IVF object, so set nprobe once here
+        faiss.GpuParameterSpace().set_index_parameter(gpu_index, "nprobe", IVF_NPROBE)
+    return gpu_index
+
+def _read_index(index_path: str) -> faiss.Index:
+    """
+    Read a FAISS index memory-mapped so the OS pages it in on demand,
+    falling back to a regular read for index types that can't be mapped.
+    """
+    try:
+        return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(index_path)
+
+def _load_index(index_path: str) -> faiss.Index:
+    """
+    Return the index at index_path, reusing the cached copy while the file
+    on disk hasn't changed.
+    """
+    mtime = os.stat(index_path).st_mtime
+    with _CACHE_LOCK:
+        cached = _INDEX_CACHE.get(index_path)
+        if cached is not None and cached[0] == mtime:
+            _INDEX_CACHE.move_to_end(index_path)
+            return cached[1]
+
+    index = _read_index(index_path)
+    if USE_GPU:
+        index = _to_gpu(index) or index
+    with _CACHE_LOCK:
+        _INDEX_CACHE[index_path] = (mtime, index)
+        _INDEX_CACHE.move_to_end(index_path)
+        while len(_INDEX_CACHE) > INDEX_CACHE_SIZE:
+            _INDEX_CACHE.popitem(last=False)
+    return index
+
+def _load_chunks(chunks_path: str) -> pa.Array:
+    """
+    Return the chunks stored at chunks_path as a memory-mapped column;
+    strings are only decoded when fetched with get_chunks.
+    """
+    with _CACHE_LOCK:
+        chunks = _CHUNK_CACHE.get(chunks_path)
+        if chunks is not None:
+            _CHUNK_CACHE.move_to_end(chunks_path)
+            return chunks
+
+    chunks = pa.ipc.open_file(pa.memory_map(chunks_path)).get_batch(0).column(0)
+    with _CACHE_LOCK:
+        _CHUNK_CACHE[chunks_path] = chunks
+        while len(_CHUNK_CACHE) > CHUNK_CACHE_SIZE:
+            _CHUNK_CACHE.popitem(last=False)
+    return chunks
+
+def evict_cached(index_path: str, chunks_path: str) -> None:
+    """
+    Drop a cached index and chunk list, e.g. when their session is cleaned up.
+    
+    Args:
+        index_path (str): Path the index was loaded from
+        chunks_path (str): Path the chunks were loaded from
+    """
+    with _CACHE_LOCK:
+        _INDEX_CACHE.pop(index_path, None)
+        _CHUNK_CACHE.pop(chunks_path, None)
+        for key in [key for key in _SEARCH_CACHE if key[0] == index_path]:
+            del _SEARCH_CACHE[key]
+
+def get_chunks(chunks: pa.Array, indices: List[int]) -> List[str]:
+    """
+    Decode only the chunks at the given positions.
+    
+    Args:
+        chunks (pa.Array): Chunk column returned by load_index_and_chunks
+        indices (List[int]): Positions to fetch, e.g. search results
+        
+    Returns:
+        List[str]: Chunk texts in the order of indices
+    """
+    return chunks.take(pa.array(indices, type=pa.int64())).to_pylist()
+
+def load_index_and_chunks(index_path: str, chunks_path: str) -> Tuple[Optional[faiss.Index], Optional[pa.Array]]:
     """
     Load FAISS index and text chunks.
     
@@ -57,22 +236,113 @@ def load_index_and_chunks(index_path: str, chunks_path: str) -> Tuple[Optional[f
         chunks_path (str): Path to the chunks file
         
     Returns:
-        Tuple[Optional[faiss.Index], Optional[List[str]]]: Loaded index and chunks
+        Tuple[Optional[faiss.Index], Optional[pa.Array]]: Loaded index and chunk column
     """
     try:
-        # Load FAISS index
-        index = faiss.read_index(index_path)
+        # Load FAISS index (cached across queries)
+        index = _load_index(index_path)
         
-        # Load chunks
-        with open(chunks_path, 'r') as f:
-            chunks = json.load(f)
-            
+        # Load chunks (cached across queries)
+        chunks = _load_chunks(chunks_path)
+
         return index, chunks
     except Exception as e:
         print(f"Error loading index and chunks: {e}")
         return None, None
 
-def search(index: faiss.Index, query_vector: np.ndarray, k: int = 3) -> Optional[List[int]]:
+@njit(cache=True, fastmath=True)
+def _prep_query_1D(vector):
+    """Cast one query vector to float32, L2-normalize it and return it as a (1, d) row."""
+    d = vector.shape[0]
+    out = np.empty((1, d), dtype=np.float32)
+    norm = 0.0
+    for j in range(d):
+        x = np.float32(vector[j])
+        out[0, j] = x
+        norm += x * x
+    if norm > 0.0:
+        scale = np.float32(1.0 / np.sqrt(norm))
+        for j in range(d):
+            out[0, j] *= scale
+    return out
+
+@njit(cache=True, fastmath=True)
+def _prep_query_2D(matrix):
+    """Cast query vectors to a contiguous float32 matrix with L2-normalized rows."""
+    n, d = matrix.shape
+    out = np.empty((n, d), dtype=np.float32)
+    for i in range(n):
+        norm = 0.0
+        for j in range(d):
+            x = np.float32(matrix[i, j])
+            out[i, j] = x
+            norm += x * x
+        if norm > 0.0:
+            scale = np.float32(1.0 / np.sqrt(norm))
+            for j in range(d):
+                out[i, j] *= scale
+    return out
+
+def search_batch(index: faiss.Index, query_vectors: np.ndarray, k: int = 3, cache_key: Optional[str] = None) -> Optional[List[List[int]]]:
+    """
+    Search for similar vectors for several queries in one FAISS call.
+    
+    Args:
+        index (faiss.Index): FAISS index to search
+        query_vectors (np.ndarray): Query vectors, one per row
+        k (int): Number of results to return per query
+        cache_key (Optional[str]): Path the index was loaded from; when given,
+            results are memoized per query vector
+        
+    Returns:
+        Optional[List[List[int]]]: Indices of similar vectors per query or None if search fails
+    """
+    try:
+        # Convert to float32 rows normalized to match the stored vectors
+        if query_vectors.ndim == 1:
+            queries = _prep_query_1D(query_vectors)
+        else:
+            queries = _prep_query_2D(query_vectors)
+
+        results: List[Optional[List[int]]] = [None] * len(queries)
+        memo_keys = None
+        if cache_key is not None:
+            memo_keys = [(cache_key, row.tobytes(), k) for row in queries]
+            with _CACHE_LOCK:
+                for i, memo_key in enumerate(memo_keys):
+                    cached = _SEARCH_CACHE.get(memo_key)
+                    if cached is not None:
+                        _SEARCH_CACHE.move_to_end(memo_key)
+                        results[i] = cached
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            # Widen the search beyond the defaults on approximate indices
+            if isinstance(index, faiss.IndexHNSW):
+                index.hnsw.efSearch = HNSW_EF_SEARCH
+            ivf = faiss.try_extract_index_ivf(index)
+            if ivf is not None:
+                ivf.nprobe = IVF_NPROBE
+
+            # Search the index
+            D, I = index.search(queries[pending], k)
+            for i, row in zip(pending, I.tolist()):
+                # Drop -1 padding returned when fewer than k neighbors exist
+                results[i] = [j for j in row if j != -1]
+
+            if memo_keys is not None:
+                with _CACHE_LOCK:
+                    for i in pending:
+                        _SEARCH_CACHE[memo_keys[i]] = results[i]
+                    while len(_SEARCH_CACHE) > SEARCH_CACHE_SIZE:
+                        _SEARCH_CACHE.popitem(last=False)
+
+        return results
+    except Exception as e:
+        print(f"Error searching index: {e}")
+        return None
+
+def search(index: faiss.Index, query_vector: np.ndarray, k: int = 3, cache_key: Optional[str] = None) -> Optional[List[int]]:
     """
     Search for similar vectors in the FAISS index.
     
@@ -80,21 +350,11 @@ def search(index: faiss.Index, query_vector: np.ndarray, k: int = 3) -> Optional
         index (faiss.Index): FAISS index to search
         query_vector (np.ndarray): Query vector
         k (int): Number of results to return
+        cache_key (Optional[str]): Path the index was loaded from; when given,
+            results are memoized per query vector
         
     Returns:
         Optional[List[int]]: Indices of similar vectors or None if search fails
     """
-    try:
-        # Reshape query vector if needed
-        if len(query_vector.shape) == 1:
-            query_vector = query_vector.reshape(1, -1)
-            
-        # Convert to float32
-        query_vector = query_vector.astype('float32')
-        
-        # Search the index
-        D, I = index.search(query_vector, k)
-        return I[0].tolist()  # Return indices of nearest neighbors
-    except Exception as e:
-        print(f"Error searching index: {e}")
-        return None 
\ No newline at end of file
+    results = search_batch(index, query_vector, k, cache_key)
+    return results[0] if results is not None else None
\ No newline at end of file
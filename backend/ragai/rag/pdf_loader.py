@@ -1,22 +1,109 @@
-from PyPDF2 import PdfReader
-from typing import Optional
+import multiprocessing
+import os
+import tempfile
+import threading
+import pypdfium2 as pdfium
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Union
 
-def pdf_to_text(file_path: str) -> Optional[str]:
+# Documents with at least this many pages are split across worker processes
+PARALLEL_MIN_PAGES = 64
+
+# PDFium isn't thread-safe: every call into it in this process holds this
+# lock, and large documents are spread over processes, not threads. It is
+# reentrant so a thread iterating pages can still call other helpers here
+_PDFIUM_LOCK = threading.RLock()
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _POOL
+
+def iter_page_texts(source: Union[str, bytes], start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
     """
-    Extract text from a PDF file.
+    Yield the text of each page of a PDF, one page at a time.
     
     Args:
-        file_path (str): Path to the PDF file
+        source (Union[str, bytes]): Path to the PDF file or its contents
+        start (int): Index of the first page to extract
+        stop (Optional[int]): Index one past the last page; None for the end
+        
+    Yields:
+        str: Text of the next page
+    """
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(source)
+        try:
+            for i in range(start, len(pdf) if stop is None else stop):
+                page = pdf[i]
+                textpage = page.get_textpage()
+                # PDFium reports CRLF line breaks
+                yield textpage.get_text_range().replace("\r\n", "\n")
+                textpage.close()
+                page.close()
+        finally:
+            pdf.close()
+
+def _extract_page_range(source: Union[str, bytes], start: int, stop: int) -> List[str]:
+    return list(iter_page_texts(source, start, stop))
+
+def _page_count(source: Union[str, bytes]) -> int:
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(source)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+def _extract_parallel(path: str, pages: int, workers: int) -> str:
+    """
+    Extract a PDF on disk with one contiguous page range per worker process.
+    """
+    step = -(-pages // workers)
+    futures = [
+        _get_pool().submit(_extract_page_range, path, start, min(start + step, pages))
+        for start in range(0, pages, step)
+    ]
+    return "\n".join(text for future in futures for text in future.result()).strip()
+
+def pdf_to_text(source: Union[str, bytes]) -> Optional[str]:
+    """
+    Extract text from a PDF. Large documents are extracted in parallel,
+    one contiguous page range per worker process.
+    
+    Args:
+        source (Union[str, bytes]): Path to the PDF file or its contents
         
     Returns:
         Optional[str]: Extracted text or None if extraction fails
     """
     try:
-        reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
+        workers = os.cpu_count() or 1
+        pages = _page_count(source)
+        if workers == 1 or pages < PARALLEL_MIN_PAGES:
+            return "\n".join(iter_page_texts(source)).strip()
+
+        if isinstance(source, str):
+            return _extract_parallel(source, pages, workers)
+
+        # Hand workers a path rather than pickling the whole upload to each.
+        # The file is closed first since Windows won't let workers reopen an
+        # open temp file
+        f = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+        try:
+            with f:
+                f.write(source)
+            return _extract_parallel(f.name, pages, workers)
+        finally:
+            os.unlink(f.name)
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
-        return None 
\ No newline at end of file
+        return None
@@ -1,11 +1,18 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 import google.generativeai as genai
-from typing import List
+from google.generativeai import caching
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, List, Optional, Set, Tuple
 from dotenv import load_dotenv
+import asyncio
+import hashlib
+import orjson
 import os
+import time
 
 # Load environment variables
 load_dotenv()
@@ -16,7 +23,35 @@ if not GOOGLE_API_KEY:
     raise ValueError("GOOGLE_API_KEY not found in environment variables")
 genai.configure(api_key=GOOGLE_API_KEY)
 
-app = FastAPI()
+MODEL_NAME = "gemini-2.5-flash"
+
+# Created once and shared across requests
+GEMINI_MODEL = genai.GenerativeModel(MODEL_NAME)
+
+# Histories at least this long (in characters; roughly the 1k-token minimum
+# Gemini will cache) are cached on Gemini as a conversation prefix. A new
+# prefix is only cached once this much history has built up past the
+# current one
+PREFIX_CACHE_MIN_CHARS = 4096
+PREFIX_CACHE_TTL = timedelta(minutes=5)
+
+# A cached prefix is only used while the history sent on top of it stays
+# under this; a longer tail means caching has fallen behind
+PREFIX_CACHE_MAX_TAIL_CHARS = 2 * PREFIX_CACHE_MIN_CHARS
+
+# After a failed create, stop creating caches for this long instead of
+# paying for a retry on every turn
+PREFIX_CACHE_RETRY_SECONDS = 300
+_prefix_backoff_until = 0.0
+
+# Cached conversation prefixes by history hash: key -> (created, cache)
+PREFIX_CACHE_SIZE = 256
+_PREFIX_CACHES: "OrderedDict[str, Tuple[float, caching.CachedContent]]" = OrderedDict()
+_PREFIX_PENDING: Set[str] = set()
+_BACKGROUND_TASKS: Set[asyncio.Task] = set()
+
+# JSON responses are serialized with orjson
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Allow frontend access
 app.add_middleware(
@@ -35,37 +70,132 @@ class ChatRequest(BaseModel):
     message: str
     history: List[Message]
 
+def prefix_keys(history: List[Message]) -> List[str]:
+    """Hash of every prefix of a history; keys[i] covers history[:i]"""
+    digest = hashlib.sha256()
+    keys = [digest.hexdigest()]
+    for msg in history:
+        digest.update(orjson.dumps((msg.role, msg.content)))
+        keys.append(digest.hexdigest())
+    return keys
+
+def to_contents(history: List[Message]) -> List[Dict]:
+    """Convert history messages to Gemini contents; Gemini calls the assistant "model" """
+    return [
+        {"role": "user" if msg.role == "user" else "model", "parts": [msg.content]}
+        for msg in history if msg.content.strip()
+    ]
+
+def get_prefix_cache(key: str) -> Optional[caching.CachedContent]:
+    """Return the cached prefix for a history hash, unless it is about to expire"""
+    entry = _PREFIX_CACHES.get(key)
+    if entry is None:
+        return None
+    created, cached = entry
+    if time.monotonic() - created > PREFIX_CACHE_TTL.total_seconds() - 30:
+        del _PREFIX_CACHES[key]
+        return None
+    _PREFIX_CACHES.move_to_end(key)
+    return cached
+
+def find_prefix_cache(keys: List[str]) -> Tuple[int, Optional[caching.CachedContent]]:
+    """Return the length and cache of the longest cached prefix of a history"""
+    for length in range(len(keys) - 1, 0, -1):
+        cached = get_prefix_cache(keys[length])
+        if cached is not None:
+            return length, cached
+    return 0, None
+
+async def cache_prefix(key: str, history: List[Message]):
+    """Cache a conversation history on Gemini so the next turn can reuse it"""
+    try:
+        cached = await asyncio.to_thread(
+            caching.CachedContent.create,
+            model=f"models/{MODEL_NAME}",
+            contents=to_contents(history),
+            ttl=PREFIX_CACHE_TTL,
+        )
+    except Exception as e:
+        global _prefix_backoff_until
+        print(f"Error caching conversation prefix: {e}")
+        _prefix_backoff_until = time.monotonic() + PREFIX_CACHE_RETRY_SECONDS
+        return
+    finally:
+        _PREFIX_PENDING.discard(key)
+
+    _PREFIX_CACHES[key] = (time.monotonic(), cached)
+    while len(_PREFIX_CACHES) > PREFIX_CACHE_SIZE:
+        _PREFIX_CACHES.popitem(last=False)
+
+def schedule_prefix_cache(key: str, history: List[Message]):
+    """Start caching a history in the background if it isn't cached yet"""
+    if key in _PREFIX_CACHES or key in _PREFIX_PENDING:
+        return
+    if time.monotonic() < _prefix_backoff_until:
+        return
+    _PREFIX_PENDING.add(key)
+    task = asyncio.create_task(cache_prefix(key, history))
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+
 @app.post("/api/chat")
 async def chat(req: ChatRequest):
     async def error_stream(error_msg: str):
         yield f"Error: {error_msg}"
 
     try:
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        
-        # Instead of rebuilding chat history, send context with the current message
-        context = ""
-        # Only use last 4 message pairs to keep context focused and reduce latency
-        relevant_history = req.history[-8:] if len(req.history) > 8 else req.history
-        
-        if relevant_history:
-            context = "Previous conversation:\n"
-            for msg in relevant_history:
-                prefix = "User: " if msg.role == "user" else "Assistant: "
-                context += f"{prefix}{msg.content}\n"
-            context += "\nCurrent conversation:\n"
-        
-        # Combine context with current message
-        full_prompt = f"{context}User: {req.message}\nAssistant:"
-        
-        # Generate response with the combined prompt
-        response = model.generate_content(full_prompt, stream=True)
-
-        def gemini_stream():
-            for chunk in response:
+        response = None
+
+        if sum(len(msg.content) for msg in req.history) >= PREFIX_CACHE_MIN_CHARS:
+            # A hit sends the cached prefix (the whole history up to an
+            # earlier turn) plus the messages after it. A miss falls back to
+            # the last-8-message prompt below, so a missing, expired or
+            # failed cache never sends more than that prompt does; the cost
+            # is that hit and miss turns see different amounts of history
+            keys = prefix_keys(req.history)
+            cached_length, cached = find_prefix_cache(keys)
+            tail = req.history[cached_length:]
+            if cached is not None and sum(len(msg.content) for msg in tail) < PREFIX_CACHE_MAX_TAIL_CHARS:
+                try:
+                    model = genai.GenerativeModel.from_cached_content(cached_content=cached)
+                    contents = to_contents(tail) + [{"role": "user", "parts": [req.message]}]
+                    response = await model.generate_content_async(contents, stream=True)
+                except Exception as e:
+                    print(f"Error using cached conversation prefix: {e}")
+                    _PREFIX_CACHES.pop(keys[cached_length], None)
+                    tail = req.history
+
+            # Creating a cache is a paid call, so one prefix is reused across
+            # turns and only replaced once enough uncached history has built
+            # up past it
+            if sum(len(msg.content) for msg in tail) >= PREFIX_CACHE_MIN_CHARS:
+                schedule_prefix_cache(keys[-1], req.history)
+
+        if response is None:
+            # Instead of rebuilding chat history, send context with the current message
+            context = ""
+            # Only use last 4 message pairs to keep context focused and reduce latency
+            relevant_history = req.history[-8:] if len(req.history) > 8 else req.history
+
+            if relevant_history:
+                context = "Previous conversation:\n"
+                for msg in relevant_history:
+                    prefix = "User: " if msg.role == "user" else "Assistant: "
+                    context += f"{prefix}{msg.content}\n"
+                context += "\nCurrent conversation:\n"
+
+            # Combine context with current message
+            full_prompt = f"{context}User: {req.message}\nAssistant:"
+
+            # Generate response with the combined prompt; the async client
+            # awaits each streamed chunk instead of blocking the event loop
+            response = await GEMINI_MODEL.generate_content_async(full_prompt, stream=True)
+
+        async def gemini_stream():
+            async for chunk in response:
                 if chunk.text:
                     yield chunk.text
 
         return StreamingResponse(gemini_stream(), media_type="text/plain")
     except Exception as e:
-        return StreamingResponse(error_stream(str(e)), media_type="text/plain") 
\ No newline at end of file
+        return StreamingResponse(error_stream(str(e)), media_type="text/plain")